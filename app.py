@@ -1,7 +1,38 @@
+import cProfile
+import logging
+import os
+import time
+from contextvars import copy_context
+import gevent
 from flask import Flask, request, jsonify
-from vod_recovery import manual_vod_recover
+from gevent.lock import BoundedSemaphore, Semaphore
+from vod_recovery import manual_vod_recover, read_config_by_key, start_recovery_trace, get_default_directory, read_vod_from_catalog, read_streamer_vods_from_catalog, read_clips_from_catalog, read_streamer_clips_from_catalog
 
 app = Flask(__name__)
+# Gunicorn leaves the root logger at WARNING, the recovery traces are logged at INFO
+app.logger.setLevel(logging.INFO)
+
+# Limits how many recoveries a single worker runs at once, extra requests are rejected instead of queued
+recovery_slots = BoundedSemaphore(read_config_by_key('settings', 'MAX_CONCURRENT_RECOVERIES'))
+# cProfile hooks the whole thread, which every greenlet of the worker shares, so only one request can be profiled at a time
+profiling_lock = Semaphore()
+
+def format_server_timing(trace):
+    return ", ".join(f"{index}-{span['stage']};dur={span['duration_ms']}" for index, span in enumerate(trace))
+
+
+def is_profiling_requested():
+    # Profiling is toggled in config/settings.json, so it can be switched on without a redeploy
+    return read_config_by_key('settings', 'ENABLE_PROFILING') and request.headers.get('X-Profile') == '1'
+
+
+def profile_recovery(name, number, timestamp, include_variants):
+    profiler = cProfile.Profile()
+    result = profiler.runcall(manual_vod_recover, name, number, timestamp, include_variants)
+    profile_path = os.path.join(get_default_directory(), f"profile_{name}_{number}_{int(time.time())}.prof")
+    profiler.dump_stats(profile_path)
+    return result, profile_path
+
 
 @app.route('/', methods=["POST"])
 def hello_world():
@@ -14,12 +45,80 @@ def hello_world():
         name = json_data.get('streamer_name', 'camila')
         number = json_data.get('stream_id', '43549753755')
         timestamp = json_data.get('timestamp', '2024-02-03 00:01:31')
+        include_variants = json_data.get('include_variants', False)
+
+        # Previously recovered videos are served from the catalog instead of probing again
+        catalog_vod = read_vod_from_catalog(name.strip(), number.strip())
+        if catalog_vod is not None:
+            if include_variants:
+                return jsonify({'m3u8_link': catalog_vod['m3u8_link'], 'variants': catalog_vod['variants']})
+            return jsonify(catalog_vod['m3u8_link'])
 
-        # Call your function with the extracted data
-        result = manual_vod_recover(name, number, timestamp)
+        profiling = is_profiling_requested()
+        if profiling and not profiling_lock.acquire(blocking=False):
+            return jsonify({'error': 'Another request is already being profiled on this worker'}), 409
+        if not recovery_slots.acquire(blocking=False):
+            if profiling:
+                profiling_lock.release()
+            return jsonify({'error': 'Server is busy, please try again later'}), 503
+        trace = start_recovery_trace()
+        profile_path = None
+        try:
+            # Call your function with the extracted data, in its own greenlet so a timeout can kill it together with its probe pools
+            if profiling:
+                recovery = gevent.spawn(copy_context().run, profile_recovery, name, number, timestamp, include_variants)
+            else:
+                recovery = gevent.spawn(copy_context().run, manual_vod_recover, name, number, timestamp, include_variants)
+            recovery.join(timeout=read_config_by_key('settings', 'RECOVERY_TIMEOUT'))
+            if not recovery.ready():
+                # kill() waits for the greenlet to exit, so the stages it was in have closed their spans
+                recovery.kill()
+                app.logger.warning("Recovery timed out for %s %s: %s", name, number, trace)
+                response = jsonify({'error': 'Recovery timed out'})
+                response.headers['Server-Timing'] = format_server_timing(trace)
+                return response, 504
+            if profiling:
+                result, profile_path = recovery.get()
+            else:
+                result = recovery.get()
+        finally:
+            recovery_slots.release()
+            if profiling:
+                profiling_lock.release()
 
+        app.logger.info("Recovery trace for %s %s: %s", name, number, trace)
         # You can return the result as JSON if needed
-        return jsonify(result)
+        response = jsonify(result)
+        response.headers['Server-Timing'] = format_server_timing(trace)
+        if profile_path is not None:
+            response.headers['X-Profile-Output'] = profile_path
+        return response
     else:
         # Return an error response if the request body is not JSON
-        return jsonify({'error': 'Invalid JSON in request body'}), 400
\ No newline at end of file
+        return jsonify({'error': 'Invalid JSON in request body'}), 400
+
+
+@app.route('/vods/<streamer_name>', methods=["GET"])
+def get_streamer_vods(streamer_name):
+    return jsonify(read_streamer_vods_from_catalog(streamer_name))
+
+
+@app.route('/vods/<streamer_name>/<video_id>', methods=["GET"])
+def get_vod(streamer_name, video_id):
+    vod = read_vod_from_catalog(streamer_name, video_id)
+    if vod is None:
+        return jsonify({'error': 'Video not found in catalog'}), 404
+    return jsonify(vod)
+
+
+@app.route('/clips/<streamer_name>', methods=["GET"])
+def get_streamer_clips(streamer_name):
+    return jsonify(read_streamer_clips_from_catalog(streamer_name))
+
+
+@app.route('/clips/<streamer_name>/<video_id>', methods=["GET"])
+def get_clips(streamer_name, video_id):
+    clip_urls = read_clips_from_catalog(streamer_name, video_id)
+    if not clip_urls:
+        return jsonify({'error': 'No clips found in catalog'}), 404
+    return jsonify({'streamer_name': streamer_name.lower(), 'video_id': video_id, 'clips': clip_urls})
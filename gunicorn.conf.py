@@ -0,0 +1,9 @@
+import os
+
+# gevent workers let a single process multiplex many recoveries on one event loop,
+# sharing the connection pool from vod_recovery.get_request_session()
+worker_class = "gevent"
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+worker_connections = int(os.environ.get("WORKER_CONNECTIONS", 100))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 180))
+bind = "0.0.0.0:" + os.environ.get("PORT", "10000")
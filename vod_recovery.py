@@ -2,19 +2,55 @@ import datetime
 import hashlib
 import json
 import csv
+import math
 import os
 import random
 import re
 import subprocess
+import base64
+import bisect
+import sqlite3
+import time
+from collections import deque
 from collections.abc import Iterable
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
 from datetime import datetime, timedelta
+from urllib.parse import urljoin, urlparse
+import gevent
 import grequests
+from gevent.pool import Pool
 import requests
 from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+
+request_session = None
+request_latencies = {}
+request_latency_counts = {}
+hedge_delays = {}
+segment_variant_suffixes = [".ts", "-muted.ts", "-unmuted.ts"]
+recovery_trace = ContextVar('recovery_trace', default=None)
+
+
+def start_recovery_trace():
+    trace = []
+    recovery_trace.set(trace)
+    return trace
+
+
+@contextmanager
+def trace_stage(stage_name):
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace = recovery_trace.get()
+        if trace is not None:
+            trace.append({'stage': stage_name, 'duration_ms': round((time.perf_counter() - start_time) * 1000, 2)})
 
 
 def print_main_menu():
-    menu_options = ["1) VOD Recovery", "2) Clip Recovery", "3) Unmute M3U8 File", "4) Verify Segment Availability", "5) Create M3U8 File (Comments out invalid segments)", "6) Download M3U8 File (.MP4 Extension)", "7) Help", "8) Exit"]
+    menu_options = ["1) VOD Recovery", "2) Clip Recovery", "3) Unmute M3U8 File", "4) Verify Segment Availability", "5) Create M3U8 File (Comments out invalid segments)", "6) Download M3U8 File (.MP4 Extension)", "7) Follow M3U8 Link (Live or Recently Archived)", "8) Help", "9) Exit"]
     print("\n".join(menu_options))
     return int(input("\nChoose an option: "))
 
@@ -101,7 +137,7 @@ def write_text_file(input_text, destination_path):
 
 def write_m3u8_to_file(m3u8_link, destination_path):
     with open(destination_path, "w") as m3u8_file:
-        m3u8_file.write(requests.get(m3u8_link).text)
+        m3u8_file.write(fetch_m3u8_playlist(m3u8_link))
     return m3u8_file
 
 
@@ -130,6 +166,196 @@ def get_vod_filepath(streamer_name, video_id):
     return vod_filename
 
 
+def get_playlist_cache_directory():
+    cache_directory = os.path.expanduser(read_config_by_key('preferences', 'PLAYLIST_CACHE_DIRECTORY'))
+    os.makedirs(cache_directory, exist_ok=True)
+    return cache_directory
+
+
+def get_playlist_cache_filepath(m3u8_link):
+    cache_key = hashlib.sha1(m3u8_link.encode('utf-8')).hexdigest()
+    return os.path.join(get_playlist_cache_directory(), f"{cache_key}.json")
+
+
+def read_cached_playlist(m3u8_link):
+    cache_path = get_playlist_cache_filepath(m3u8_link)
+    try:
+        with open(cache_path, "r") as cache_file:
+            cached_playlist = json.load(cache_file)
+        os.utime(cache_path)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(cached_playlist, dict) or 'playlist' not in cached_playlist:
+        return None
+    return cached_playlist
+
+
+def get_cached_playlist_headers(cached_playlist):
+    headers = {}
+    if not cached_playlist:
+        return headers
+    if cached_playlist.get('etag'):
+        headers['If-None-Match'] = cached_playlist['etag']
+    if cached_playlist.get('last_modified'):
+        headers['If-Modified-Since'] = cached_playlist['last_modified']
+    return headers
+
+
+def store_cached_playlist(m3u8_link, response):
+    etag = response.headers.get('ETag')
+    last_modified = response.headers.get('Last-Modified')
+    if not etag and not last_modified:
+        return
+    cache_path = get_playlist_cache_filepath(m3u8_link)
+    temp_path = f"{cache_path}.{os.getpid()}.{random.getrandbits(32):08x}.tmp"
+    try:
+        with open(temp_path, "w") as cache_file:
+            json.dump({'url': m3u8_link, 'etag': etag, 'last_modified': last_modified, 'playlist': response.text}, cache_file)
+        os.replace(temp_path, cache_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    evict_playlist_cache()
+
+
+def evict_playlist_cache():
+    max_cache_size = read_config_by_key('preferences', 'PLAYLIST_CACHE_MAX_SIZE_MB') * 1024 * 1024
+    cache_directory = get_playlist_cache_directory()
+    cache_files = []
+    for file in os.listdir(cache_directory):
+        if not file.endswith(".json"):
+            continue
+        try:
+            file_stat = os.stat(os.path.join(cache_directory, file))
+        except FileNotFoundError:
+            continue
+        cache_files.append((file_stat.st_mtime, file_stat.st_size, os.path.join(cache_directory, file)))
+    cache_files.sort()
+    cache_size = sum(file_size for _, file_size, _ in cache_files)
+    for _, file_size, cache_path in cache_files:
+        if cache_size <= max_cache_size:
+            break
+        cache_size -= file_size
+        try:
+            os.remove(cache_path)
+        except FileNotFoundError:
+            pass
+
+
+def request_m3u8_playlist(m3u8_link):
+    # A 304 is answered from the cached entry whose validators were sent, so it is returned as a 200
+    cached_playlist = read_cached_playlist(m3u8_link)
+    response = get_request_session().get(m3u8_link, headers=get_cached_playlist_headers(cached_playlist), timeout=get_request_timeout())
+    if response.status_code == 304:
+        if cached_playlist:
+            return 200, cached_playlist['playlist']
+        response = get_request_session().get(m3u8_link, timeout=get_request_timeout())
+    if response.status_code == 200:
+        store_cached_playlist(m3u8_link, response)
+    return response.status_code, response.text
+
+
+def fetch_m3u8_playlist(m3u8_link):
+    return request_m3u8_playlist(m3u8_link)[1]
+
+
+def get_catalog_connection():
+    connection = sqlite3.connect(os.path.expanduser(read_config_by_key('preferences', 'CATALOG_FILEPATH')))
+    connection.row_factory = sqlite3.Row
+    connection.executescript("""
+        CREATE TABLE IF NOT EXISTS vods (
+            streamer_name TEXT NOT NULL,
+            video_id TEXT NOT NULL,
+            m3u8_link TEXT NOT NULL,
+            domain TEXT NOT NULL,
+            variants TEXT NOT NULL,
+            duration_seconds REAL,
+            segment_count INTEGER,
+            muted INTEGER NOT NULL,
+            recovered_at TEXT NOT NULL,
+            PRIMARY KEY (streamer_name, video_id)
+        );
+        CREATE INDEX IF NOT EXISTS vods_video_id ON vods (video_id);
+        CREATE TABLE IF NOT EXISTS clips (
+            streamer_name TEXT NOT NULL,
+            video_id TEXT NOT NULL,
+            clip_url TEXT NOT NULL,
+            recovered_at TEXT NOT NULL,
+            PRIMARY KEY (streamer_name, video_id, clip_url)
+        );
+    """)
+    return connection
+
+
+def build_vod_catalog_record(streamer_name, video_id, m3u8_link, variants):
+    parsed_link = urlparse(m3u8_link)
+    if variants:
+        duration_seconds, segment_count = variants[0]['duration_seconds'], variants[0]['segment_count']
+    else:
+        duration_seconds, segment_count = parse_m3u8_segment_info(fetch_m3u8_playlist(m3u8_link))
+    return (streamer_name.lower(), video_id, m3u8_link, f"{parsed_link.scheme}://{parsed_link.netloc}/", json.dumps(variants), duration_seconds, segment_count, int(is_video_muted(m3u8_link)), datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+
+
+def write_vods_to_catalog(vod_records):
+    if not vod_records:
+        return
+    connection = get_catalog_connection()
+    with connection:
+        connection.executemany("INSERT OR REPLACE INTO vods VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", vod_records)
+    connection.close()
+
+
+def write_clips_to_catalog(streamer_name, video_id, clip_urls):
+    if not clip_urls:
+        return
+    recovered_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    connection = get_catalog_connection()
+    with connection:
+        connection.executemany("INSERT OR IGNORE INTO clips VALUES (?, ?, ?, ?)", [(streamer_name.lower(), video_id, clip_url, recovered_at) for clip_url in clip_urls])
+    connection.close()
+
+
+def format_catalog_vod(connection, vod_row):
+    vod = dict(vod_row)
+    vod['variants'] = json.loads(vod['variants'])
+    vod['muted'] = bool(vod['muted'])
+    vod['clips'] = [row['clip_url'] for row in connection.execute("SELECT clip_url FROM clips WHERE streamer_name = ? AND video_id = ? ORDER BY clip_url", (vod['streamer_name'], vod['video_id']))]
+    return vod
+
+
+def read_vod_from_catalog(streamer_name, video_id):
+    connection = get_catalog_connection()
+    vod_row = connection.execute("SELECT * FROM vods WHERE streamer_name = ? AND video_id = ?", (streamer_name.lower(), video_id)).fetchone()
+    vod = format_catalog_vod(connection, vod_row) if vod_row is not None else None
+    connection.close()
+    return vod
+
+
+def read_streamer_vods_from_catalog(streamer_name):
+    connection = get_catalog_connection()
+    vod_rows = connection.execute("SELECT * FROM vods WHERE streamer_name = ? ORDER BY recovered_at DESC", (streamer_name.lower(),)).fetchall()
+    vods = [format_catalog_vod(connection, vod_row) for vod_row in vod_rows]
+    connection.close()
+    return vods
+
+
+def read_clips_from_catalog(streamer_name, video_id):
+    # Clips are usually recovered without the video, so they are read on their own instead of through the vods table
+    connection = get_catalog_connection()
+    clip_urls = [row['clip_url'] for row in connection.execute("SELECT clip_url FROM clips WHERE streamer_name = ? AND video_id = ? ORDER BY clip_url", (streamer_name.lower(), video_id))]
+    connection.close()
+    return clip_urls
+
+
+def read_streamer_clips_from_catalog(streamer_name):
+    connection = get_catalog_connection()
+    streamer_clips = {}
+    for row in connection.execute("SELECT video_id, clip_url FROM clips WHERE streamer_name = ? ORDER BY video_id, clip_url", (streamer_name.lower(),)):
+        streamer_clips.setdefault(row['video_id'], []).append(row['clip_url'])
+    connection.close()
+    return streamer_clips
+
+
 def return_user_agent():
     user_agents = read_text_file('config/user_agents.txt')
     header = {
@@ -138,6 +364,79 @@ def return_user_agent():
     return header
 
 
+def get_request_timeout():
+    return read_config_by_key('settings', 'REQUEST_TIMEOUT')
+
+
+def get_request_session():
+    global request_session
+    if request_session is None:
+        pool_size = read_config_by_key('settings', 'CONNECTION_POOL_SIZE')
+        request_session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        request_session.mount("http://", adapter)
+        request_session.mount("https://", adapter)
+    return request_session
+
+
+def record_request_latency(latency_key, latency):
+    # Domain probes and segment checks keep separate windows, a fast 403 from a probe says nothing about segment latency
+    latencies = request_latencies.setdefault(latency_key, deque(maxlen=1000))
+    latencies.append(latency)
+    request_latency_counts[latency_key] = request_latency_counts.get(latency_key, 0) + 1
+    # The percentile is refreshed every 50 samples rather than sorting the window on every request
+    if request_latency_counts[latency_key] % 50 == 0:
+        ordered_latencies = sorted(latencies)
+        percentile = read_config_by_key('settings', 'HEDGE_PERCENTILE')
+        hedge_delays[latency_key] = ordered_latencies[min(len(ordered_latencies) - 1, int(len(ordered_latencies) * percentile / 100))]
+
+
+def send_head_request(url, timeout, latency_key):
+    start_time = time.perf_counter()
+    try:
+        return get_request_session().head(url, timeout=timeout)
+    except requests.RequestException:
+        return None
+    finally:
+        # Failed and cancelled requests are recorded too, leaving them out would pull the percentile down
+        record_request_latency(latency_key, time.perf_counter() - start_time)
+
+
+@contextmanager
+def unordered_pool_results(function, iterable, size=100):
+    # When the calling greenlet is killed (the API recovery timeout) the pool and its mapper die with it,
+    # otherwise the remaining probes would keep running after the request has already returned
+    pool = Pool(size)
+    results = pool.imap_unordered(function, iterable)
+    try:
+        yield results
+    finally:
+        results.kill()
+        pool.kill()
+
+
+def hedged_head_request(url, timeout, latency_key, hedge_requests):
+    # Once the primary request is slower than the latency percentile a duplicate is sent. Any answer from the primary
+    # is accepted but the duplicate only wins with a 200, so a fast error never replaces a slow success
+    primary_request = gevent.spawn(send_head_request, url, timeout, latency_key)
+    hedged_requests = [primary_request]
+    try:
+        hedge_delay = hedge_delays.get(latency_key)
+        if not hedge_requests or hedge_delay is None:
+            return primary_request.get()
+        primary_request.join(timeout=hedge_delay)
+        if primary_request.ready():
+            return primary_request.value
+        hedged_requests.append(gevent.spawn(send_head_request, url, timeout, latency_key))
+        for finished_request in gevent.iwait(hedged_requests):
+            response = finished_request.value
+            if response is not None and (finished_request is primary_request or response.status_code == 200):
+                return response
+        return hedged_requests[1].value
+    finally:
+        gevent.killall(hedged_requests)
+
+
 def calculate_epoch_timestamp(timestamp, seconds):
     epoch_timestamp = ((datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S") + timedelta(seconds=seconds)) - datetime(1970, 1, 1)).total_seconds()
     return epoch_timestamp
@@ -149,7 +448,7 @@ def calculate_days_since_broadcast(start_timestamp):
 
 
 def is_video_muted(m3u8_link):
-    response = requests.get(m3u8_link).text
+    response = fetch_m3u8_playlist(m3u8_link)
     return bool("unmuted" in response)
 
 
@@ -224,14 +523,10 @@ def extract_offset(clip_url):
 
 
 def get_clip_format(video_id, offsets):
-    default_clip_list = [f"https://clips-media-assets2.twitch.tv/{video_id}-offset-{i}.mp4" for i in range(0, offsets, 2)]
-    alternate_clip_list = [f"https://clips-media-assets2.twitch.tv/vod-{video_id}-offset-{i}.mp4" for i in range(0, offsets, 2)]
-    legacy_clip_list = [f"https://clips-media-assets2.twitch.tv/{video_id}-index-{i:010}.mp4" for i in range(offsets)]
-
     clip_format_dict = {
-        "1": default_clip_list,
-        "2": alternate_clip_list,
-        "3": legacy_clip_list
+        "1": (f"https://clips-media-assets2.twitch.tv/{video_id}-offset-{{}}.mp4", range(0, offsets, 2)),
+        "2": (f"https://clips-media-assets2.twitch.tv/vod-{video_id}-offset-{{}}.mp4", range(0, offsets, 2)),
+        "3": (f"https://clips-media-assets2.twitch.tv/{video_id}-index-{{:010}}.mp4", range(offsets))
     }
 
     return clip_format_dict
@@ -267,25 +562,33 @@ def manual_clip_recover(streamer_name, video_id, hours, minutes):
     clip_recover(streamer_name, video_id, calculate_broadcast_duration_in_minutes(hours, minutes))
 
 
+def parse_tracker_url(tracker_url):
+    if "streamscharts" in tracker_url:
+        return parse_streamscharts_url(tracker_url)
+    elif "twitchtracker" in tracker_url:
+        return parse_twitchtracker_url(tracker_url)
+    elif "sullygnome" in tracker_url:
+        return parse_sullygnome_url(tracker_url)
+    return None
+
+
 def website_clip_recover():
     tracker_url = input("Enter Twitchtracker/Streamscharts/Sullygnome url:  ")
     if not tracker_url.startswith("https://"):
         tracker_url = "https://" + tracker_url
-    if "streamscharts" in tracker_url:
-        streamer, video_id = parse_streamscharts_url(tracker_url)
-        clip_recover(streamer, video_id, parse_duration_streamscharts(tracker_url))
-    elif "twitchtracker" in tracker_url:
-        streamer, video_id = parse_twitchtracker_url(tracker_url)
-        clip_recover(streamer, video_id, int(parse_duration_twitchtracker(tracker_url)))
-    elif "sullygnome" in tracker_url:
-        streamer, video_id = parse_sullygnome_url(tracker_url)
-        clip_recover(streamer, video_id, int(parse_duration_sullygnome(tracker_url)))
-    else:
+    tracker_info = parse_tracker_url(tracker_url)
+    if tracker_info is None:
         print("Link not supported.. Returning to main menu.")
         return
+    streamer, video_id = tracker_info
+    stream_metadata = resolve_stream_metadata(streamer, video_id)
+    if stream_metadata is None:
+        print("Unable to retrieve the stream information from any website.. Returning to main menu.")
+        return
+    clip_recover(streamer, video_id, stream_metadata['duration'])
 
 
-def manual_vod_recover(streamer_name, video_id, timestamp):
+def manual_vod_recover(streamer_name, video_id, timestamp, include_variants=False):
     streamer_name = streamer_name.lower().strip()
     video_id = video_id.strip()
     timestamp = timestamp.strip()
@@ -298,102 +601,155 @@ def manual_vod_recover(streamer_name, video_id, timestamp):
     if not timestamp:
         return "Invalid timestamp format, Please provide a valid timestamp (YYYY-MM-DD HH:MM:SS)."
 
-    m3u8_link = vod_recover(streamer_name, video_id, timestamp)
-    process_m3u8_configuration(m3u8_link)
+    m3u8_link, variants, message = vod_recover_variants(streamer_name, video_id, timestamp)
+    if not variants:
+        return message
+    playlist_segments = process_m3u8_configuration(m3u8_link)
+    write_vods_to_catalog([build_vod_catalog_record(streamer_name, video_id, m3u8_link, variants)])
+    if include_variants:
+        return {'m3u8_link': m3u8_link, 'variants': variants, 'segments': summarize_playlist_segments(playlist_segments) if playlist_segments is not None else None}
     return m3u8_link
 
 def website_vod_recover():
     tracker_url = input("Enter Twitchtracker/Streamscharts/Sullygnome url:  ").strip()
     if not tracker_url.startswith("https://"):
         tracker_url = "https://" + tracker_url
-    if "streamscharts" in tracker_url:
-        streamer, video_id = parse_streamscharts_url(tracker_url)
-        m3u8_link = vod_recover(streamer, video_id, parse_datetime_streamscharts(tracker_url))
-        if m3u8_link is not None:
-            process_m3u8_configuration(m3u8_link)
-            m3u8_duration = return_m3u8_duration(m3u8_link)
-            streamscharts_duration = int(parse_duration_streamscharts(tracker_url))
-            if streamscharts_duration >= m3u8_duration + 10:
-                print("Streamscharts is generally considered the most reliable source for this data. The discrepancy in durations is likely an anomaly.")
-    elif "twitchtracker" in tracker_url:
-        streamer, video_id = parse_twitchtracker_url(tracker_url)
-        m3u8_link = vod_recover(streamer, video_id, parse_datetime_twitchtracker(tracker_url))
-        if m3u8_link is not None:
-            process_m3u8_configuration(m3u8_link)
-            m3u8_duration = return_m3u8_duration(m3u8_link)
-            streamer = parse_streamer_from_m3u8_link(m3u8_link)
-            video_id = parse_video_id_from_m3u8_link(m3u8_link)
-            streamscharts_url = generate_website_links(streamer, video_id)[2]
-            modified_streamscharts_url = streamscharts_url[:streamscharts_url.rfind('/')]
-            twitchtracker_duration = int(parse_duration_twitchtracker(tracker_url))
-            if twitchtracker_duration >= m3u8_duration + 10:
-                print(f"The duration from Twitchtracker exceeds the M3U8 duration by over 10 minutes. Consider checking Streamscharts for a split stream. URL: {modified_streamscharts_url}")
-    elif "sullygnome" in tracker_url:
-        streamer, video_id = parse_sullygnome_url(tracker_url)
-        m3u8_link = vod_recover(streamer, video_id, parse_datetime_sullygnome(tracker_url))
-        if m3u8_link is not None:
-            process_m3u8_configuration(m3u8_link)
-            m3u8_duration = return_m3u8_duration(m3u8_link)
-            streamer = parse_streamer_from_m3u8_link(m3u8_link)
-            video_id = parse_video_id_from_m3u8_link(m3u8_link)
-            streamscharts_url = generate_website_links(streamer, video_id)[2]
-            modified_streamscharts_url = streamscharts_url[:streamscharts_url.rfind('/')]
-            sullygnome_duration = int(parse_duration_sullygnome(tracker_url))
-            if sullygnome_duration >= m3u8_duration + 10:
-                print(f"The duration from Sullygnome exceeds the M3U8 duration by over 10 minutes. Consider checking Streamscharts for a split stream. URL: {modified_streamscharts_url}")
-    else:
+    tracker_info = parse_tracker_url(tracker_url)
+    if tracker_info is None:
         print("Link not supported.. Returning to main menu.")
         return
+    streamer, video_id = tracker_info
+    stream_metadata = resolve_stream_metadata(streamer, video_id)
+    if stream_metadata is None:
+        print("Unable to retrieve the stream information from any website.. Returning to main menu.")
+        return
+    m3u8_link, variants, message = vod_recover_variants(streamer, video_id, stream_metadata['timestamp'], stream_metadata['seconds_window'])
+    if not variants and stream_metadata['seconds_window'] != range(60):
+        # A tracker can be off by more than the tolerance, the rest of the minute is searched like a minute precision timestamp
+        stream_timestamp = datetime.strptime(stream_metadata['timestamp'], "%Y-%m-%d %H:%M:%S")
+        seconds_window = [seconds for seconds in range(60) if seconds - stream_timestamp.second not in stream_metadata['seconds_window']]
+        print("Nothing found around the tracker timestamp, searching the whole minute...")
+        m3u8_link, variants, message = vod_recover_variants(streamer, video_id, stream_timestamp.replace(second=0).strftime("%Y-%m-%d %H:%M:%S"), seconds_window)
+    if not variants:
+        print(message)
+        return
+    process_m3u8_configuration(m3u8_link)
+    write_vods_to_catalog([build_vod_catalog_record(streamer, video_id, m3u8_link, variants)])
+    m3u8_duration = return_m3u8_duration(m3u8_link)
+    streamscharts_url = generate_website_links(streamer, video_id)[2]
+    modified_streamscharts_url = streamscharts_url[:streamscharts_url.rfind('/')]
+    if stream_metadata['duration'] >= m3u8_duration + 10:
+        print(f"The duration from {', '.join(stream_metadata['websites']).title()} exceeds the M3U8 duration by over 10 minutes. Consider checking Streamscharts for a split stream. URL: {modified_streamscharts_url}")
 
 
 def get_all_clip_urls(clip_format_dict, clip_format_list):
-    combined_clip_format_list = []
-    for key, value in clip_format_dict.items():
+    for key, (url_template, offsets) in clip_format_dict.items():
         if key in clip_format_list:
-            combined_clip_format_list += value
-    return combined_clip_format_list
+            for offset in offsets:
+                yield url_template.format(offset)
+
+
+def count_clip_urls(clip_format_dict, clip_format_list):
+    return sum(len(offsets) for key, (_, offsets) in clip_format_dict.items() if key in clip_format_list)
 
 
-def get_vod_urls(streamer_name, video_id, start_timestamp):
+def sample_clip_urls(clip_format_dict, clip_format_list):
+    # Walks the candidate space in a random affine order (start + i * step mod n) so clips are drawn
+    # from across the whole stream without building or shuffling a list of every URL
+    selected_formats = [(url_template, offsets) for key, (url_template, offsets) in clip_format_dict.items() if key in clip_format_list]
+    total_url_count = sum(len(offsets) for _, offsets in selected_formats)
+    if total_url_count == 0:
+        return
+    step = random.randrange(1, total_url_count + 1)
+    while math.gcd(step, total_url_count) != 1:
+        step = random.randrange(1, total_url_count + 1)
+    start = random.randrange(total_url_count)
+    for i in range(total_url_count):
+        index = (start + i * step) % total_url_count
+        for url_template, offsets in selected_formats:
+            if index < len(offsets):
+                yield url_template.format(offsets[index])
+                break
+            index -= len(offsets)
+
+
+def find_vod_variants(streamer_name, video_id, start_timestamp, seconds_window=None):
     m3u8_link_list, successful_m3u8_link_list = [], []
+    variant_discovery = None
     domains = read_text_file('config/domains.txt')
-    for seconds in range(60):
-        base_url = f"{streamer_name}_{video_id}_{int(calculate_epoch_timestamp(start_timestamp, seconds))}"
-        hashed_base_url = str(hashlib.sha1(base_url.encode('utf-8')).hexdigest())[:20]
-        for domain in domains:
-            m3u8_link_list.append(f"{domain}{hashed_base_url}_{base_url}/chunked/index-dvr.m3u8")
-    request_session = requests.Session()
-    rs = [grequests.head(u, session=request_session) for u in m3u8_link_list]
-    for response in grequests.imap(rs, size=100):
-        if response.status_code == 200:
-            successful_m3u8_link_list.append(response.url)
-    if successful_m3u8_link_list:
-        return random.choice(successful_m3u8_link_list)
-    else:
-        return
+    with trace_stage("candidate_generation"):
+        for seconds in (seconds_window or range(60)):
+            base_url = f"{streamer_name}_{video_id}_{int(calculate_epoch_timestamp(start_timestamp, seconds))}"
+            hashed_base_url = str(hashlib.sha1(base_url.encode('utf-8')).hexdigest())[:20]
+            for domain in domains:
+                m3u8_link_list.append(f"{domain}{hashed_base_url}_{base_url}/chunked/index-dvr.m3u8")
+    with trace_stage("domain_probe"):
+        timeout, hedge_requests = get_request_timeout(), read_config_by_key('settings', 'HEDGE_REQUESTS')
+        try:
+            with unordered_pool_results(lambda link: hedged_head_request(link, timeout, "domain_probe", hedge_requests), m3u8_link_list) as responses:
+                for response in responses:
+                    if response is not None and response.status_code == 200:
+                        successful_m3u8_link_list.append(response.url)
+                        # Start on the quality ladder as soon as the first base path is known, while the remaining probes finish
+                        if variant_discovery is None:
+                            variant_discovery = gevent.spawn(copy_context().run, get_vod_variants, response.url)
+            if successful_m3u8_link_list:
+                return successful_m3u8_link_list[0], variant_discovery.get()
+            else:
+                return None, []
+        finally:
+            if variant_discovery is not None:
+                variant_discovery.kill()
+
 
+def parse_m3u8_segment_info(playlist):
+    total_duration, segment_count = 0, 0
+    for line in playlist.splitlines():
+        if line.startswith("#EXTINF:"):
+            total_duration += float(line.split(":")[1].split(",")[0])
+        elif line and not line.startswith("#"):
+            segment_count += 1
+    return total_duration, segment_count
+
+
+def fetch_m3u8_segment_info(m3u8_link):
+    try:
+        total_duration, segment_count = parse_m3u8_segment_info(fetch_m3u8_playlist(m3u8_link))
+    except requests.RequestException as e:
+        # The link itself is valid, a failed playlist fetch only leaves the duration unknown
+        print(f"Unable to fetch the playlist for its duration: {e}")
+        return None, None
+    return round(total_duration, 3), segment_count
 
-def return_supported_qualities(m3u8_link):
-    valid_resolutions = []
+
+@trace_stage("supported_qualities")
+def get_vod_variants(m3u8_link):
     resolutions = ["chunked", "1080p60", "1080p30", "720p60", "720p30", "480p60", "480p30"]
-    if m3u8_link is None:
-        return None
-    request_list = [grequests.get(m3u8_link.replace("chunked", resolution)) for resolution in resolutions]
-    responses = grequests.map(request_list, size=100)
-    for resolution, response in zip(resolutions, responses):
-        if response and response.status_code == 200:
-            valid_resolutions.append(resolution)
-            print(f"{len(valid_resolutions)}. {resolution}")
+    variant_links = [m3u8_link.replace("chunked", resolution) for resolution in resolutions]
+    # Availability is checked with HEAD requests, every variant shares the segment timeline of the source playlist
+    timeout = get_request_timeout()
+    source_playlist = gevent.spawn(fetch_m3u8_segment_info, m3u8_link)
     try:
-        choice = 1
-        if 1 <= choice <= len(valid_resolutions):
-            quality = valid_resolutions[choice - 1]
-            user_option = m3u8_link.replace("chunked", quality)
-            return user_option
-        else:
-            print("Invalid option. Please try again!")
-            return
-    except ValueError:
+        with unordered_pool_results(lambda index: (index, send_head_request(variant_links[index], timeout, "variant")), range(len(variant_links))) as results:
+            variant_responses = dict(results)
+        responses = [variant_responses[index] for index in range(len(variant_links))]
+        total_duration, segment_count = source_playlist.get()
+    finally:
+        source_playlist.kill()
+    variants = []
+    for resolution, link, response in zip(resolutions, variant_links, responses):
+        # chunked was already answered with a 200 by the domain probe, a failed HEAD here does not make it unavailable
+        if (response is not None and response.status_code == 200) or resolution == "chunked":
+            variants.append({'quality': resolution, 'm3u8_link': link, 'duration_seconds': total_duration, 'segment_count': segment_count})
+    return variants
+
+
+def select_vod_variant(variants):
+    for index, variant in enumerate(variants, start=1):
+        print(f"{index}. {variant['quality']}")
+    if variants:
+        return variants[0]['m3u8_link']
+    else:
         print("Invalid option. Please try again!")
         return
 
@@ -418,243 +774,432 @@ def parse_website_duration(duration_string):
     return calculate_broadcast_duration_in_minutes(hours, minutes)
 
 
-def parse_duration_streamscharts(streamcharts_url):
+def fetch_tracker_page(tracker_url):
+    try:
+        response = requests.get(tracker_url, headers=return_user_agent(), timeout=get_request_timeout())
+    except requests.RequestException as error:
+        print("Error: Unable to fetch webpage.", error)
+        return None
+    if response.status_code != 200:
+        print("Error: Unable to fetch webpage. Status code:", response.status_code)
+        return None
+    return BeautifulSoup(response.content, 'html.parser')
+
+
+def fetch_streamscharts_page(streamscharts_url):
     retries = 10
-    reqs = [grequests.get(streamcharts_url, headers=return_user_agent()) for _ in range(retries)]
-    for response in grequests.imap(reqs, size=10):
-        if response.status_code == 200:
-            bs = BeautifulSoup(response.content, 'html.parser')
-            streamcharts_duration = bs.find_all('div', {'class': 'text-xs font-bold'})[3].text
-            streamcharts_duration_in_minutes = parse_website_duration(streamcharts_duration)
-            return streamcharts_duration_in_minutes
+    # Streamscharts rejects most requests, the first of the concurrent attempts to get through is used
+    with unordered_pool_results(lambda _: fetch_tracker_page(streamscharts_url), range(retries), size=retries) as pages:
+        for page in pages:
+            if page is not None:
+                return page
     print("Failed to fetch webpage after 10 retries.")
     return None
 
 
-def parse_duration_twitchtracker(twitchtracker_url):
-    response = requests.get(twitchtracker_url, headers=return_user_agent())
-    if response.status_code == 200:
-        bs = BeautifulSoup(response.content, 'html.parser')
-        twitchtracker_duration = bs.find_all('div', {'class': 'g-x-s-value'})[0].text
-        return twitchtracker_duration
-    else:
-        print("Error: Unable to fetch webpage. Status code:", response.status_code)
-        return None
+def parse_duration_streamscharts(bs):
+    streamcharts_duration = bs.find_all('div', {'class': 'text-xs font-bold'})[3].text
+    return parse_website_duration(streamcharts_duration)
 
 
-def parse_duration_sullygnome(sullygnome_url):
-    response = requests.get(sullygnome_url, headers=return_user_agent())
-    if response.status_code == 200:
-        bs = BeautifulSoup(response.content, 'html.parser')
-        sullygnome_duration = bs.find_all('div', {'class': 'MiddleSubHeaderItemValue'})[7].text.split(",")
-        sullygnome_duration_in_minutes = parse_website_duration(sullygnome_duration)
-        return sullygnome_duration_in_minutes
-    else:
-        print("Error: Unable to fetch webpage. Status code:", response.status_code)
-        return None
+def parse_duration_twitchtracker(bs):
+    return bs.find_all('div', {'class': 'g-x-s-value'})[0].text
 
 
-def parse_datetime_streamscharts(streamscharts_url):
-    retries = 10
-    reqs = [grequests.get(streamscharts_url, headers=return_user_agent()) for _ in range(retries)]
-    for response in grequests.imap(reqs, size=10):
-        if response.status_code == 200:
-            bs = BeautifulSoup(response.content, 'html.parser')
-            streamscharts_datetime = bs.find_all('time', {'class': 'ml-2 font-bold'})[0].text.strip().replace(",", "") + ":00"
-            return datetime.strptime(streamscharts_datetime, "%d %b %Y %H:%M:%S").strftime("%Y-%m-%d %H:%M:%S")
-    print("Failed to fetch webpage after 10 retries.")
-    return None
+def parse_duration_sullygnome(bs):
+    sullygnome_duration = bs.find_all('div', {'class': 'MiddleSubHeaderItemValue'})[7].text.split(",")
+    return parse_website_duration(sullygnome_duration)
 
 
-def parse_datetime_twitchtracker(twitchtracker_url):
-    response = requests.get(twitchtracker_url, headers=return_user_agent())
-    if response.status_code == 200:
-        bs = BeautifulSoup(response.content, 'html.parser')
-        twitchtracker_datetime = bs.find_all('div', {'class': 'stream-timestamp-dt'})[0].text
-        return twitchtracker_datetime
-    else:
-        print("Error: Unable to fetch webpage. Status code:", response.status_code)
+def parse_datetime_streamscharts(bs):
+    streamscharts_datetime = bs.find_all('time', {'class': 'ml-2 font-bold'})[0].text.strip().replace(",", "") + ":00"
+    return datetime.strptime(streamscharts_datetime, "%d %b %Y %H:%M:%S").strftime("%Y-%m-%d %H:%M:%S")
+
+
+def parse_datetime_twitchtracker(bs):
+    return bs.find_all('div', {'class': 'stream-timestamp-dt'})[0].text
+
+
+def parse_datetime_sullygnome(bs):
+    stream_date = bs.find_all('div', {'class': 'MiddleSubHeaderItemValue'})[6].text
+    modified_stream_date = remove_chars_from_ordinal_numbers(stream_date)
+    formatted_stream_date = datetime.strptime(modified_stream_date, "%A %d %B %I:%M%p").strftime("%m-%d %H:%M:%S")
+    stream_datetime = datetime.strptime(str(datetime.now().year) + "-" + formatted_stream_date, "%Y-%m-%d %H:%M:%S")
+    # Sullygnome omits the year, a date in the future belongs to a stream from last year
+    if stream_datetime > datetime.now():
+        stream_datetime = stream_datetime.replace(year=stream_datetime.year - 1)
+    return stream_datetime.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def parse_tracker_metadata(website_name, tracker_url):
+    page_fetchers = {"sullygnome": fetch_tracker_page, "twitchtracker": fetch_tracker_page, "streamscharts": fetch_streamscharts_page}
+    datetime_parsers = {"sullygnome": parse_datetime_sullygnome, "twitchtracker": parse_datetime_twitchtracker, "streamscharts": parse_datetime_streamscharts}
+    duration_parsers = {"sullygnome": parse_duration_sullygnome, "twitchtracker": parse_duration_twitchtracker, "streamscharts": parse_duration_streamscharts}
+    with trace_stage("scrape_tracker"):
+        bs = page_fetchers[website_name](tracker_url)
+    if bs is None:
+        return None
+    try:
+        timestamp = datetime.strptime(datetime_parsers[website_name](bs).strip(), "%Y-%m-%d %H:%M:%S")
+        duration = int(duration_parsers[website_name](bs))
+    except (ValueError, IndexError, AttributeError, TypeError):
+        print(f"Error: Unable to parse the stream metadata from {website_name}.")
         return None
+    return {'website': website_name, 'timestamp': timestamp, 'duration': duration}
 
 
-def parse_datetime_sullygnome(sullygnome_url):
-    response = requests.get(sullygnome_url, headers=return_user_agent())
-    if response.status_code == 200:
-        bs = BeautifulSoup(response.content, 'html.parser')
-        stream_date = bs.find_all('div', {'class': 'MiddleSubHeaderItemValue'})[6].text
-        modified_stream_date = remove_chars_from_ordinal_numbers(stream_date)
-        formatted_stream_date = datetime.strptime(modified_stream_date, "%A %d %B %I:%M%p").strftime("%m-%d %H:%M:%S")
-        return str(datetime.now().year) + "-" + formatted_stream_date
+def is_tracker_metadata_consistent(first_metadata, second_metadata):
+    # Minute precision sources truncate the seconds, durations follow the 10 minute tolerance used elsewhere
+    return abs((first_metadata['timestamp'] - second_metadata['timestamp']).total_seconds()) < 60 and abs(first_metadata['duration'] - second_metadata['duration']) < 10
+
+
+def reconcile_tracker_metadata(metadata_list):
+    # Streamscharts is the most reliable source, the most precise timestamp decides how many seconds need probing
+    metadata_list = sorted(metadata_list, key=lambda metadata: ["streamscharts", "twitchtracker", "sullygnome"].index(metadata['website']))
+    precise_timestamps = [metadata['timestamp'] for metadata in metadata_list if metadata['timestamp'].second != 0]
+    tolerance = read_config_by_key('settings', 'TRACKER_SECONDS_TOLERANCE')
+    if precise_timestamps:
+        timestamp, seconds_window = precise_timestamps[0], range(-tolerance, tolerance + 1)
     else:
-        print("Error: Unable to fetch webpage. Status code:", response.status_code)
-        return None
+        timestamp, seconds_window = metadata_list[0]['timestamp'], range(60)
+    return {'timestamp': timestamp.strftime("%Y-%m-%d %H:%M:%S"), 'duration': metadata_list[0]['duration'], 'seconds_window': seconds_window, 'websites': [metadata['website'] for metadata in metadata_list]}
+
+
+@trace_stage("resolve_tracker_metadata")
+def resolve_stream_metadata(streamer_name, video_id):
+    website_names = ["sullygnome", "twitchtracker", "streamscharts"]
+    lookups = [gevent.spawn(copy_context().run, parse_tracker_metadata, website_name, tracker_url) for website_name, tracker_url in zip(website_names, generate_website_links(streamer_name, video_id))]
+    completed_metadata = []
+    try:
+        for lookup in gevent.iwait(lookups):
+            metadata = lookup.value
+            if metadata is None:
+                continue
+            consistent_metadata = [other for other in completed_metadata if is_tracker_metadata_consistent(metadata, other)]
+            completed_metadata.append(metadata)
+            if consistent_metadata:
+                return reconcile_tracker_metadata([metadata] + consistent_metadata)
+    finally:
+        # Blocking so the losing sources have stopped their requests before recovery continues
+        gevent.killall(lookups)
+    if completed_metadata:
+        return reconcile_tracker_metadata(completed_metadata[:1])
+    return None
 
 
+def resolve_segment_variants(base_link, segment_indices):
+    # Best first, the original segment is only served again once Twitch restores the audio
+    variant_suffixes = [".ts", "-unmuted.ts", "-muted.ts"]
+    candidate_links = [f"{base_link}{index}{suffix}" for index in segment_indices for suffix in variant_suffixes]
+    timeout = get_request_timeout()
+    with unordered_pool_results(lambda link: send_head_request(link, timeout, "segment"), candidate_links) as responses:
+        available_links = {response.url for response in responses if response is not None and response.status_code == 200}
+    resolved_segments, served_indices = {}, set()
+    for index in segment_indices:
+        variant_links = [f"{base_link}{index}{suffix}" for suffix in variant_suffixes]
+        served_link = next((link for link in variant_links if link in available_links), None)
+        if served_link is not None:
+            served_indices.add(index)
+        resolved_segments[index] = served_link or f"{base_link}{index}-muted.ts"
+    return resolved_segments, served_indices
+
+
+def mark_resolved_segments(playlist_segments, segment_indices, served_indices):
+    # Every variant of a resolved segment was already probed, one that was not served is unavailable without a second check
+    for index in segment_indices:
+        set_bitmap_bit(playlist_segments['checked'], index - playlist_segments['first_index'])
+    for index in served_indices:
+        set_bitmap_bit(playlist_segments['available'], index - playlist_segments['first_index'])
+
+
+@trace_stage("unmute_playlist")
 def unmute_vod(m3u8_link):
     counter = 0
     video_filepath = get_vod_filepath(parse_streamer_from_m3u8_link(m3u8_link), parse_video_id_from_m3u8_link(m3u8_link))
     write_m3u8_to_file(m3u8_link, video_filepath)
     file_contents = read_text_file(video_filepath)
-    if is_video_muted(m3u8_link):
-        with open(video_filepath, "w") as video_file:
-            for segment in file_contents:
-                m3u8_link = m3u8_link.replace("index-dvr.m3u8", "")
-                if "-unmuted" in segment and not segment.startswith("#"):
-                    counter += 1
-                    video_file.write(f"{m3u8_link}{counter - 1}-muted.ts\n")
-                elif "-unmuted" not in segment and not segment.startswith("#"):
-                    counter += 1
-                    video_file.write(f"{m3u8_link}{counter - 1}.ts\n")
-                else:
-                    video_file.write(f"{segment}\n")
+    m3u8_link = m3u8_link.replace("index-dvr.m3u8", "")
+    playlist_segments = [segment for segment in file_contents if not segment.startswith("#")]
+    muted_segment_indices = [index for index, segment in enumerate(playlist_segments) if "muted" in segment]
+    resolved_segments, served_indices = resolve_segment_variants(m3u8_link, muted_segment_indices)
+    segment_links = []
+    with open(video_filepath, "w") as video_file:
+        for segment in file_contents:
+            if not segment.startswith("#"):
+                segment_links.append(resolved_segments.get(counter, f"{m3u8_link}{counter}.ts"))
+                video_file.write(f"{segment_links[-1]}\n")
+                counter += 1
+            else:
+                video_file.write(f"{segment}\n")
+    if muted_segment_indices:
         print(f"{os.path.normpath(video_filepath)} Has been unmuted!")
-    else:
-        with open(video_filepath, "w") as video_file:
-            for segment in file_contents:
-                m3u8_link = m3u8_link.replace("index-dvr.m3u8", "")
-                if not segment.startswith("#"):
-                    video_file.write(f"{m3u8_link}{counter}.ts\n")
-                    counter += 1
-                else:
-                    video_file.write(f"{segment}\n")
+    # The resolved variants are what validation has to check, and the resolved segments need no second probe
+    playlist_segments = parse_playlist_segments(segment_links, m3u8_link)
+    mark_resolved_segments(playlist_segments, muted_segment_indices, served_indices)
+    return playlist_segments
 
 
 def mark_invalid_segments_in_playlist(m3u8_link):
-    unmute_vod(m3u8_link)
+    playlist_segments = validate_playlist_segments(unmute_vod(m3u8_link))
     vod_file_path = get_vod_filepath(parse_streamer_from_m3u8_link(m3u8_link), parse_video_id_from_m3u8_link(m3u8_link))
     with open(vod_file_path, "r") as f:
         lines = f.read().splitlines()
-    segments = validate_playlist_segments(get_all_playlist_segments(m3u8_link))
-    if not segments:
+    if count_bitmap_bits(playlist_segments['available']) == 0:
         print("No segments are valid. Cannot generate M3U8! Returning to main menu.")
         os.remove(vod_file_path)
         return
-    playlist_segments = [segment for segment in segments if segment in lines]
+    counter = 0
     modified_playlist = []
     for line in lines:
-        if line in playlist_segments:
+        if line.startswith("#") or not line.endswith(".ts"):
             modified_playlist.append(line)
-        elif line.startswith("#"):
-            modified_playlist.append(line)
-        elif line.endswith(".ts"):
-            modified_playlist.append("#" + line)
         else:
-            modified_playlist.append(line)
+            modified_playlist.append(line if get_bitmap_bit(playlist_segments['available'], counter) else "#" + line)
+            counter += 1
     with open(vod_file_path, "w") as f:
         f.write("\n".join(modified_playlist))
 
 
 def return_m3u8_duration(m3u8_link):
-    total_duration = 0
-    file_contents = requests.get(m3u8_link, stream=True).text.splitlines()
-    for line in file_contents:
-        if line.startswith("#EXTINF:"):
-            segment_duration = float(line.split(":")[1].split(",")[0])
-            total_duration += segment_duration
+    total_duration, _ = parse_m3u8_segment_info(fetch_m3u8_playlist(m3u8_link))
     total_minutes = int(total_duration // 60)
     return total_minutes
 
 
 def process_m3u8_configuration(m3u8_link):
-    playlist_segments = get_all_playlist_segments(m3u8_link)
     if is_video_muted(m3u8_link):
         print(m3u8_link, "\nVideo contains muted segments")
         if read_config_by_key('settings', 'UNMUTE_VIDEO'):
-            unmute_vod(m3u8_link)
+            playlist_segments = unmute_vod(m3u8_link)
+        else:
+            playlist_segments = get_all_playlist_segments(m3u8_link)
     else:
         print(m3u8_link, "\nVideo does NOT contain muted segments")
+        playlist_segments = get_all_playlist_segments(m3u8_link)
         os.remove(get_vod_filepath(parse_streamer_from_m3u8_link(m3u8_link), parse_video_id_from_m3u8_link(m3u8_link)))
     if read_config_by_key('settings', 'CHECK_SEGMENTS'):
-        validate_playlist_segments(playlist_segments)
-    return m3u8_link
+        return validate_playlist_segments(playlist_segments)
+    return None
+
+
+def create_bitmap(size):
+    return bytearray((size + 7) // 8)
+
+
+def set_bitmap_bit(bitmap, index):
+    bitmap[index >> 3] |= 1 << (index & 7)
+
+
+def get_bitmap_bit(bitmap, index):
+    return bool(bitmap[index >> 3] & (1 << (index & 7)))
+
 
+def count_bitmap_bits(bitmap):
+    return sum(bin(byte).count("1") for byte in bitmap)
 
+
+def create_playlist_segments(base_link, segment_variants, first_index=0):
+    # Segment first_index + i is base_link + its number + its variant suffix, availability is one bit per segment
+    # and checked marks the segments whose availability is already known
+    return {'base_link': base_link, 'first_index': first_index, 'segment_variants': segment_variants, 'available': create_bitmap(len(segment_variants)), 'checked': create_bitmap(len(segment_variants))}
+
+
+def get_playlist_segment_link(playlist_segments, index):
+    return f"{playlist_segments['base_link']}{playlist_segments['first_index'] + index}{segment_variant_suffixes[playlist_segments['segment_variants'][index]]}"
+
+
+def parse_playlist_segments(lines, base_link, first_index=0):
+    segment_variants = bytearray()
+    for line in lines:
+        if not line.startswith("#") and line.endswith(".ts"):
+            segment_variants.append(next((variant for variant in (2, 1) if line.endswith(segment_variant_suffixes[variant])), 0))
+    return create_playlist_segments(base_link, segment_variants, first_index)
+
+
+def summarize_playlist_segments(playlist_segments):
+    return {
+        'base_link': playlist_segments['base_link'],
+        'first_index': playlist_segments['first_index'],
+        'segment_count': len(playlist_segments['segment_variants']),
+        'available_count': count_bitmap_bits(playlist_segments['available']),
+        'available_bitmap': base64.b64encode(playlist_segments['available']).decode('ascii')
+    }
+
+
+@trace_stage("rewrite_playlist")
 def get_all_playlist_segments(m3u8_link):
-    counter = 0
-    segment_list = []
+    segment_variants = bytearray()
     video_file_path = get_vod_filepath(parse_streamer_from_m3u8_link(m3u8_link), parse_video_id_from_m3u8_link(m3u8_link))
     write_m3u8_to_file(m3u8_link, video_file_path)
     file_contents = read_text_file(video_file_path)
+    m3u8_link = m3u8_link.replace("index-dvr.m3u8", "")
     with open(video_file_path, "w") as video_file:
         for segment in file_contents:
-            m3u8_link = m3u8_link.replace("index-dvr.m3u8", "")
-            if "-unmuted" in segment and not segment.startswith("#"):
-                counter += 1
-                new_segment = f"{m3u8_link}{counter - 1}-muted.ts"
-                video_file.write(f"{new_segment}\n")
-                segment_list.append(new_segment)
-            elif "-unmuted" not in segment and not segment.startswith("#"):
-                counter += 1
-                new_segment = f"{m3u8_link}{counter - 1}.ts"
-                video_file.write(f"{new_segment}\n")
-                segment_list.append(new_segment)
+            if not segment.startswith("#"):
+                segment_variants.append(1 if "-unmuted" in segment else 0)
+                video_file.write(f"{m3u8_link}{len(segment_variants) - 1}{segment_variant_suffixes[segment_variants[-1]]}\n")
             else:
                 video_file.write(f"{segment}\n")
-    video_file.close()
-    return segment_list
-
-
-def validate_playlist_segments(segments):
-    valid_segments = []
-    all_segments = [url.strip() for url in segments]
-    available_segment_count = 0
-    request_session = grequests.Session()
-    rs = (grequests.head(u, session=request_session) for u in all_segments)
-    responses = grequests.imap(rs, size=100)
-    for i, response in enumerate(responses):
-        print(f"\rChecking segments.. {i + 1} / {len(all_segments)}", end="")
-        if response is not None:
-            if response.status_code == 200:
-                available_segment_count += 1
-                valid_segments.append(response.url)
-    if (available_segment_count == len(all_segments)) or (available_segment_count == 0):
-        print(f"\n{available_segment_count} out of {len(all_segments)} Segments are Available.")
-    elif available_segment_count < len(all_segments):
-        print(f"\n{available_segment_count} out of {len(all_segments)} Segments are Available. Please see option 5 of the main menu!")
-    return valid_segments
+    return create_playlist_segments(m3u8_link, segment_variants)
+
+
+@trace_stage("validate_segments")
+def validate_playlist_segments(playlist_segments):
+    segment_count = len(playlist_segments['segment_variants'])
+    # Segments resolved while unmuting are not probed again
+    unchecked_indices = [index for index in range(segment_count) if not get_bitmap_bit(playlist_segments['checked'], index)]
+    timeout, hedge_requests = get_request_timeout(), read_config_by_key('settings', 'HEDGE_REQUESTS')
+    with unordered_pool_results(lambda index: (index, hedged_head_request(get_playlist_segment_link(playlist_segments, index), timeout, "segment", hedge_requests)), unchecked_indices) as responses:
+        for i, (index, response) in enumerate(responses):
+            print(f"\rChecking segments.. {i + 1} / {len(unchecked_indices)}", end="")
+            set_bitmap_bit(playlist_segments['checked'], index)
+            if response is not None and response.status_code == 200:
+                set_bitmap_bit(playlist_segments['available'], index)
+    available_segment_count = count_bitmap_bits(playlist_segments['available'])
+    if (available_segment_count == segment_count) or (available_segment_count == 0):
+        print(f"\n{available_segment_count} out of {segment_count} Segments are Available.")
+    elif available_segment_count < segment_count:
+        print(f"\n{available_segment_count} out of {segment_count} Segments are Available. Please see option 5 of the main menu!")
+    return playlist_segments
+
+
+def parse_playlist_entries(playlist):
+    header_lines, segment_entries = [], []
+    segment_duration = 0
+    for line in playlist.splitlines():
+        if line.startswith("#EXTINF:"):
+            segment_duration = float(line.split(":")[1].split(",")[0])
+        elif line and not line.startswith("#"):
+            segment_entries.append((segment_duration, line))
+        elif line and not segment_entries and line != "#EXT-X-ENDLIST":
+            header_lines.append(line)
+    return header_lines, segment_entries
+
+
+def process_new_playlist_segments(m3u8_link, segment_entries, cursor, video_file, download_segments):
+    base_link = m3u8_link.replace("index-dvr.m3u8", "")
+    segment_links = [urljoin(base_link, segment) for _, segment in segment_entries]
+    muted_segment_indices, served_indices = [], set()
+    if read_config_by_key('settings', 'UNMUTE_VIDEO'):
+        # Checked on the playlist entries, the joined links also contain the streamer name
+        muted_segment_indices = [cursor + index for index, (_, segment) in enumerate(segment_entries) if segment.endswith(("-muted.ts", "-unmuted.ts"))]
+        resolved_segments, served_indices = resolve_segment_variants(base_link, muted_segment_indices)
+        for index, link in resolved_segments.items():
+            segment_links[index - cursor] = link
+    playlist_segments = parse_playlist_segments(segment_links, base_link, cursor)
+    mark_resolved_segments(playlist_segments, muted_segment_indices, served_indices)
+    if read_config_by_key('settings', 'CHECK_SEGMENTS'):
+        validate_playlist_segments(playlist_segments)
+    else:
+        playlist_segments['available'] = bytearray(b"\xff" * len(playlist_segments['available']))
+    available_segments = []
+    for index, ((duration, _), link) in enumerate(zip(segment_entries, segment_links)):
+        available = get_bitmap_bit(playlist_segments['available'], index)
+        video_file.write(f"#EXTINF:{duration},\n{link if available else '#' + link}\n")
+        if available:
+            available_segments.append((duration, link))
+    video_file.flush()
+    if download_segments and available_segments:
+        part_filepath = os.path.join(get_default_directory(), f"{parse_streamer_from_m3u8_link(m3u8_link)}_{parse_video_id_from_m3u8_link(m3u8_link)}_{cursor}.m3u8")
+        write_m3u8_slice(available_segments, 0, len(available_segments), part_filepath)
+        download_m3u8_video_file(part_filepath, f"{os.path.splitext(os.path.basename(part_filepath))[0]}.mp4")
+        os.remove(part_filepath)
+
+
+def poll_m3u8_playlist(m3u8_link):
+    try:
+        status_code, playlist = request_m3u8_playlist(m3u8_link)
+    except requests.RequestException as e:
+        print(f"\nUnable to fetch the playlist: {e}")
+        return None
+    if status_code != 200:
+        print(f"\nUnable to fetch the playlist. Status code: {status_code}")
+        return None
+    return playlist
 
 
-def vod_recover(streamer_name, video_id, timestamp):
+def follow_m3u8_playlist(m3u8_link, download_segments=False):
+    # The cursor is the number of segments already handled, each poll only works on the entries past it
+    cursor, idle_polls = 0, 0
+    poll_interval = read_config_by_key('settings', 'FOLLOW_POLL_INTERVAL')
+    max_idle_polls = read_config_by_key('settings', 'FOLLOW_MAX_IDLE_POLLS')
+    video_filepath = get_vod_filepath(parse_streamer_from_m3u8_link(m3u8_link), parse_video_id_from_m3u8_link(m3u8_link))
+    with open(video_filepath, "w") as video_file:
+        while True:
+            playlist = poll_m3u8_playlist(m3u8_link)
+            # A failed poll counts as idle and keeps the cursor, the next one picks up where this one left off
+            header_lines, segment_entries = parse_playlist_entries(playlist) if playlist is not None else ([], [])
+            if cursor == 0 and segment_entries:
+                video_file.write("\n".join(header_lines) + "\n")
+            new_segment_entries = segment_entries[cursor:]
+            if new_segment_entries:
+                print(f"\n{len(new_segment_entries)} new segment(s) found, {cursor + len(new_segment_entries)} in total")
+                process_new_playlist_segments(m3u8_link, new_segment_entries, cursor, video_file, download_segments)
+                cursor += len(new_segment_entries)
+                idle_polls = 0
+            else:
+                idle_polls += 1
+            if playlist is not None and "#EXT-X-ENDLIST" in playlist:
+                video_file.write("#EXT-X-ENDLIST\n")
+                print("The playlist has ended, stopping follow mode.")
+                break
+            if idle_polls >= max_idle_polls:
+                print(f"No new segments after {idle_polls} polls, stopping follow mode.")
+                break
+            gevent.sleep(poll_interval)
+    print(f"{os.path.normpath(video_filepath)} contains {cursor} segment(s)")
+    return cursor
+
+
+def vod_recover_variants(streamer_name, video_id, timestamp, seconds_window=None):
     print("Searching for videos...")
     vod_age = calculate_days_since_broadcast(timestamp)
     if vod_age > 60:
-        return "Video is older than 60 days. Chances of recovery are very slim.\n"
-    vod_url = return_supported_qualities(get_vod_urls(streamer_name, video_id, timestamp))
+        return None, [], "Video is older than 60 days. Chances of recovery are very slim.\n"
+    _, variants = find_vod_variants(streamer_name, video_id, timestamp, seconds_window)
+    vod_url = select_vod_variant(variants)
     if vod_url is None:
         alternate_websites = '\n'.join(generate_website_links(streamer_name, video_id))
-        print(f"No videos found using the current domain list. Try using an alternate website:\n{alternate_websites}")
-        return
-    return vod_url
+        return None, [], f"No videos found using the current domain list. Try using an alternate website:\n{alternate_websites}"
+    return vod_url, variants, None
 
 
 def bulk_vod_recovery():
     csv_file_path = get_and_validate_csv_filename()
     streamer_name = parse_streamer_from_csv_filename(csv_file_path)
     csv_file = parse_vod_csv_file(csv_file_path)
+    catalog_batch_size = read_config_by_key('settings', 'CATALOG_BATCH_SIZE')
+    vod_records = []
     for timestamp, video_id in csv_file.items():
         print("\n" + "Recovering Video....", video_id)
-        m3u8_link = get_vod_urls(streamer_name.lower(), video_id, timestamp)
+        m3u8_link, variants = find_vod_variants(streamer_name.lower(), video_id, timestamp)
         if m3u8_link is not None:
             process_m3u8_configuration(m3u8_link)
+            vod_records.append(build_vod_catalog_record(streamer_name, video_id, m3u8_link, variants))
+            if len(vod_records) >= catalog_batch_size:
+                write_vods_to_catalog(vod_records)
+                vod_records = []
         else:
             print("No vods found using the current domain list.")
+    write_vods_to_catalog(vod_records)
 
 
 def clip_recover(streamer, video_id, duration):
     iteration_counter, valid_counter = 0, 0
     valid_url_list = []
     clip_format = print_clip_format_menu().split(" ")
-    full_url_list = get_all_clip_urls(get_clip_format(video_id, calculate_max_clip_offset(duration)), clip_format)
-    request_session = requests.Session()
-    rs = [grequests.head(u, session=request_session) for u in full_url_list]
+    clip_format_dict = get_clip_format(video_id, calculate_max_clip_offset(duration))
+    total_url_count = count_clip_urls(clip_format_dict, clip_format)
+    rs = (grequests.head(u, session=get_request_session(), timeout=get_request_timeout()) for u in get_all_clip_urls(clip_format_dict, clip_format))
     for response in grequests.imap(rs, size=100):
         iteration_counter += 1
-        print(f'\rSearching for clips..... {iteration_counter} of {len(full_url_list)}', end=" ", flush=True)
+        print(f'\rSearching for clips..... {iteration_counter} of {total_url_count}', end=" ", flush=True)
         if response.status_code == 200:
             valid_counter += 1
             valid_url_list.append(response.url)
     print(f"\n{valid_counter} Clip(s) Found")
     if valid_url_list:
+        write_clips_to_catalog(streamer, video_id, valid_url_list)
         for url in valid_url_list:
             write_text_file(url, get_log_filepath(streamer, video_id))
         if read_config_by_key('settings', 'DOWNLOAD_CLIPS') or input("Do you want to download the recovered clips (Y/N): ").upper() == "Y":
@@ -723,27 +1268,45 @@ def merge_csv_files(csv_filename, directory_path):
     print("CSV files merged successfully!")
 
 
+def find_random_clips(clip_url_sampler, clip_count, found_clips):
+    if len(found_clips) >= clip_count:
+        return found_clips
+    timeout = get_request_timeout()
+    # The pool only pulls a new URL from the sampler when a probe finishes, leaving the block cancels the probes still in flight
+    with unordered_pool_results(lambda url: (url, send_head_request(url, timeout, "clip")), clip_url_sampler) as responses:
+        for url, response in responses:
+            if response is not None and response.status_code == 200:
+                found_clips.append(url)
+                if len(found_clips) >= clip_count:
+                    break
+    return found_clips
+
+
 def random_clip_recovery(video_id, hours, minutes):
-    counter = 0
+    displayed_counter = 0
     display_limit = 3
+    found_clips = []
     clip_format = print_clip_format_menu().split(" ")
-    full_url_list = get_all_clip_urls(get_clip_format(video_id, calculate_max_clip_offset(calculate_broadcast_duration_in_minutes(hours, minutes))), clip_format)
-    random.shuffle(full_url_list)
-    print(f"Total Number of URLs: {len(full_url_list)}")
-    request_session = requests.Session()
-    rs = (grequests.head(url, session=request_session) for url in full_url_list)
-    responses = grequests.imap(rs, size=100)
-    for response in responses:
-        if counter < display_limit:
-            if response.status_code == 200:
-                counter += 1
-                print(response.url)
-            if counter == display_limit:
-                user_option = input("Do you want to see more URLs (Y/N): ")
-                if user_option.upper() == "Y":
-                    display_limit += 3
-        else:
+    clip_format_dict = get_clip_format(video_id, calculate_max_clip_offset(calculate_broadcast_duration_in_minutes(hours, minutes)))
+    print(f"Total Number of URLs: {count_clip_urls(clip_format_dict, clip_format)}")
+    clip_url_sampler = sample_clip_urls(clip_format_dict, clip_format)
+    find_random_clips(clip_url_sampler, display_limit, found_clips)
+    while True:
+        for url in found_clips[displayed_counter:display_limit]:
+            print(url)
+        displayed_counter = min(len(found_clips), display_limit)
+        if displayed_counter < display_limit:
+            if displayed_counter == 0:
+                print("No clips found! Returning to main menu.")
             break
+        display_limit += 3
+        # Search for the next page while waiting on the user, input() runs in a thread so the probes keep going
+        prefetch = gevent.spawn(find_random_clips, clip_url_sampler, display_limit, found_clips)
+        user_option = gevent.get_hub().threadpool.apply(input, ("Do you want to see more URLs (Y/N): ",))
+        if user_option.upper() != "Y":
+            prefetch.kill()
+            break
+        prefetch.join()
 
 
 def bulk_clip_recovery():
@@ -769,26 +1332,29 @@ def bulk_clip_recovery():
     clip_format = print_clip_format_menu().split(" ")
     stream_info_dict = parse_clip_csv_file(csv_file_path)
     for video_id, values in stream_info_dict.items():
+        valid_url_list = []
         vod_counter += 1
         print(
             f"\nProcessing Past Broadcast:\n"
             f"Stream Date: {values[0].replace('-', ' ')}\n"
             f"Vod ID: {video_id}\n"
             f"Vod Number: {vod_counter} of {len(stream_info_dict)}\n")
-        original_vod_url_list = get_all_clip_urls(get_clip_format(video_id, values[1]), clip_format)
-        request_session = requests.Session()
-        rs = [grequests.head(u, session=request_session) for u in original_vod_url_list]
+        clip_format_dict = get_clip_format(video_id, values[1])
+        total_url_count = count_clip_urls(clip_format_dict, clip_format)
+        rs = (grequests.head(u, session=get_request_session(), timeout=get_request_timeout()) for u in get_all_clip_urls(clip_format_dict, clip_format))
         for response in grequests.imap(rs, size=100):
             total_counter += 1
             iteration_counter += 1
-            print(f'\rSearching for clips..... {iteration_counter} of {len(original_vod_url_list)}', end=" ", flush=True)
+            print(f'\rSearching for clips..... {iteration_counter} of {total_url_count}', end=" ", flush=True)
             total_counter = 0
             if response.status_code == 200:
                 valid_counter += 1
+                valid_url_list.append(response.url)
                 write_text_file(response.url, get_log_filepath(streamer_name, video_id))
             else:
                 continue
         print(f'\n{valid_counter} Clip(s) Found')
+        write_clips_to_catalog(streamer_name, video_id, valid_url_list)
         if valid_counter != 0:
             if user_option.upper() == "Y":
                 download_clips(get_default_directory(), streamer_name, video_id)
@@ -826,9 +1392,92 @@ def download_m3u8_video_url(m3u8_link, output_filename):
     subprocess.call(command, shell=True)
 
 
-def download_m3u8_video_url_slice(m3u8_link, output_filename, video_start_time, video_end_time):
-    command = read_config_by_key('settings', 'DOWNLOAD_M3U8_VIDEO_URL_SLICE').format(video_start_time, video_end_time, m3u8_link, os.path.join(get_default_directory(), output_filename))
+def parse_time_to_seconds(time_string):
+    # Same syntax ffmpeg accepts for durations, [HH:]MM:SS[.m...] or S+[.m...][s|ms|us]
+    time_string = time_string.strip()
+    seconds_match = re.fullmatch(r"(\d+(?:\.\d*)?)(s|ms|us)?", time_string)
+    if seconds_match:
+        return float(seconds_match.group(1)) / {None: 1, 's': 1, 'ms': 1000, 'us': 1000000}[seconds_match.group(2)]
+    clock_match = re.fullmatch(r"(?:(\d+):)?(\d{1,2}):(\d{1,2}(?:\.\d*)?)", time_string)
+    if not clock_match or int(clock_match.group(2)) >= 60 or float(clock_match.group(3)) >= 60:
+        raise ValueError(f"Invalid time: {time_string}")
+    hours, minutes, seconds = clock_match.groups()
+    return (int(hours or 0) * 3600) + (int(minutes) * 60) + float(seconds)
+
+
+def input_video_time_range():
+    while True:
+        video_start_time = input("Enter start time (HH:MM:SS, MM:SS or seconds): ")
+        video_end_time = input("Enter end time (HH:MM:SS, MM:SS or seconds): ")
+        try:
+            if parse_time_to_seconds(video_end_time) > parse_time_to_seconds(video_start_time):
+                return video_start_time, video_end_time
+            print("The end time has to be after the start time, please try again!")
+        except ValueError as error:
+            print(f"{error}, please try again!")
+
+
+def build_m3u8_segment_index(playlist, base_link):
+    segment_starts, segments, muted_segment_indices = [], [], []
+    total_duration, segment_duration = 0, 0
+    for line in playlist.splitlines():
+        if line.startswith("#EXTINF:"):
+            segment_duration = float(line.split(":")[1].split(",")[0])
+        elif line and not line.startswith("#"):
+            # Checked on the playlist entry, the joined link also contains the streamer name
+            if line.endswith(("-muted.ts", "-unmuted.ts")):
+                muted_segment_indices.append(len(segments))
+            segment_starts.append(total_duration)
+            segments.append((segment_duration, urljoin(base_link, line)))
+            total_duration += segment_duration
+    return segment_starts, segments, muted_segment_indices
+
+
+def find_segment_window(segment_starts, start_seconds, end_seconds):
+    first_segment = max(bisect.bisect_right(segment_starts, start_seconds) - 1, 0)
+    last_segment = max(bisect.bisect_left(segment_starts, end_seconds), first_segment + 1)
+    return first_segment, last_segment
+
+
+def write_m3u8_slice(segments, first_segment, last_segment, destination_path):
+    with open(destination_path, "w") as m3u8_file:
+        m3u8_file.write("#EXTM3U\n#EXT-X-VERSION:3\n")
+        m3u8_file.write(f"#EXT-X-TARGETDURATION:{math.ceil(max(duration for duration, _ in segments[first_segment:last_segment]))}\n")
+        m3u8_file.write(f"#EXT-X-MEDIA-SEQUENCE:{first_segment}\n")
+        for duration, link in segments[first_segment:last_segment]:
+            m3u8_file.write(f"#EXTINF:{duration},\n{link}\n")
+        m3u8_file.write("#EXT-X-ENDLIST\n")
+
+
+def slice_m3u8_playlist(playlist, base_link, video_start_time, video_end_time, destination_path, resolve_muted_segments=False):
+    # Only the segments covering [start, end] are written, ffmpeg then trims the edges locally
+    start_seconds, end_seconds = parse_time_to_seconds(video_start_time), parse_time_to_seconds(video_end_time)
+    segment_starts, segments, muted_segment_indices = build_m3u8_segment_index(playlist, base_link)
+    if not segments:
+        return None
+    first_segment, last_segment = find_segment_window(segment_starts, start_seconds, end_seconds)
+    if resolve_muted_segments:
+        segment_base_link = base_link.replace("index-dvr.m3u8", "")
+        window_muted_segment_indices = [index for index in muted_segment_indices if first_segment <= index < last_segment]
+        for index, link in resolve_segment_variants(segment_base_link, window_muted_segment_indices)[0].items():
+            segments[index] = (segments[index][0], link)
+    write_m3u8_slice(segments, first_segment, last_segment, destination_path)
+    return start_seconds - segment_starts[first_segment], end_seconds - segment_starts[first_segment]
+
+
+def download_m3u8_slice(playlist, base_link, output_filename, video_start_time, video_end_time, command_key, resolve_muted_segments=False):
+    slice_filepath = os.path.join(get_default_directory(), f"{os.path.splitext(output_filename)[0]}_slice.m3u8")
+    relative_times = slice_m3u8_playlist(playlist, base_link, video_start_time, video_end_time, slice_filepath, resolve_muted_segments)
+    if relative_times is None:
+        print("The M3U8 does not contain any segments!")
+        return
+    command = read_config_by_key('settings', command_key).format(relative_times[0], relative_times[1], slice_filepath, os.path.join(get_default_directory(), output_filename))
     subprocess.call(command, shell=True)
+    os.remove(slice_filepath)
+
+
+def download_m3u8_video_url_slice(m3u8_link, output_filename, video_start_time, video_end_time):
+    download_m3u8_slice(fetch_m3u8_playlist(m3u8_link), m3u8_link, output_filename, video_start_time, video_end_time, 'DOWNLOAD_M3U8_VIDEO_URL_SLICE', resolve_muted_segments=True)
 
 
 def download_m3u8_video_file(m3u8_file_path, output_filename):
@@ -837,16 +1486,17 @@ def download_m3u8_video_file(m3u8_file_path, output_filename):
 
 
 def download_m3u8_video_file_slice(m3u8_file_path, output_filename, video_start_time, video_end_time):
-    command = read_config_by_key('settings', 'DOWNLOAD_M3U8_VIDEO_FILE_SLICE').format(video_start_time, video_end_time, m3u8_file_path, os.path.join(get_default_directory(), output_filename))
-    subprocess.call(command, shell=True)
+    with open(m3u8_file_path, "r") as m3u8_file:
+        playlist = m3u8_file.read()
+    download_m3u8_slice(playlist, os.path.abspath(m3u8_file_path), output_filename, video_start_time, video_end_time, 'DOWNLOAD_M3U8_VIDEO_FILE_SLICE')
 
 
 def run_vod_recover():
     print("WELCOME TO VOD RECOVERY" + "\n")
     menu = 0
-    while menu < 8:
+    while menu < 9:
         menu = print_main_menu()
-        if menu == 8:
+        if menu == 9:
             exit()
         elif menu == 1:
             vod_mode = print_video_mode_menu()
@@ -907,8 +1557,7 @@ def run_vod_recover():
                 vod_filename = "{}_{}.mp4".format(parse_streamer_from_m3u8_link(vod_url), parse_video_id_from_m3u8_link(vod_url))
                 trim_vod = input("Would you like to specify the start and end time of the vod (Y/N)? ")
                 if trim_vod.upper() == "Y":
-                    vod_start_time = input("Enter start time (HH:MM:SS): ")
-                    vod_end_time = input("Enter end time (HH:MM:SS): ")
+                    vod_start_time, vod_end_time = input_video_time_range()
                     download_m3u8_video_url_slice(vod_url, vod_filename, vod_start_time, vod_end_time)
                     print("Vod downloaded to {}".format(os.path.join(get_default_directory(), vod_filename)))
                 else:
@@ -918,8 +1567,7 @@ def run_vod_recover():
                 m3u8_file_path = input("Enter absolute file path of the M3U8: ").strip()
                 trim_vod = input("Would you like to specify the start and end time of the vod (Y/N)? ")
                 if trim_vod.upper() == "Y":
-                    vod_start_time = input("Enter start time (HH:MM:SS): ")
-                    vod_end_time = input("Enter end time (HH:MM:SS): ")
+                    vod_start_time, vod_end_time = input_video_time_range()
                     download_m3u8_video_file_slice(m3u8_file_path, parse_vod_filename(m3u8_file_path) + ".mp4", vod_start_time, vod_end_time)
                     print("Vod downloaded to {}".format(os.path.join(get_default_directory(), parse_vod_filename(m3u8_file_path) + ".mp4")))
                 else:
@@ -928,6 +1576,10 @@ def run_vod_recover():
             elif download_type == 3:
                 exit()
         elif menu == 7:
+            url = input("Enter M3U8 Link: ").strip()
+            download_segments = input("Do you want to download new segments as they appear (Y/N): ").upper() == "Y"
+            follow_m3u8_playlist(url, download_segments)
+        elif menu == 8:
             print_help()
         else:
             print("Invalid Option! Exiting...")